@@ -2,19 +2,38 @@ from __future__ import annotations
 
 import os
 import re
-from datetime import datetime
 from decimal import ROUND_HALF_UP, Decimal
+from time import localtime, strftime
 from typing import Optional
 
 from pydantic import BaseModel, Field, ValidationError
-from telegram import Update
+from telegram import Message, Update
 from telegram.ext import (ApplicationBuilder, ContextTypes, MessageHandler,
                           filters)
 
-from parser_old_bill import TelegramBillParser
+from parser_old_bill import (TelegramBillParser, UtilityBill, UtilityReading,
+                             normalize_decimal)
 
 __all__ = ["main"]
 
+# Токены команды: пара key=value либо отдельное число
+_TOKEN_RE = re.compile(
+    r"(?P<key>\w+?)\s*=\s*(?P<value>[0-9]+(?:[.,][0-9]+)?)|(?P<num>\d+(?:[.,]\d+)?)",
+    flags=re.I,
+)
+
+# Полные имена показаний (алиасы InputData) → короткие ключи
+_KEY_ALIASES = {"cold_water": "cw", "hot_water": "hw", "electricity": "el"}
+
+_Q_CENT = Decimal("0.01")
+_D_ZERO = Decimal("0")
+
+# Команда: meter, /meter или .meter в начале сообщения (без учёта регистра)
+_METER_PREFIXES = ("meter", "/meter", ".meter")
+
+# Парсер не хранит состояния между сообщениями — создаём один на весь процесс
+_PARSER = TelegramBillParser()
+
 
 class InputData(BaseModel):
     """Новые показания + возможные пользовательские тарифы."""
@@ -36,32 +55,73 @@ class InputData(BaseModel):
 
 
 def _round(val: Decimal) -> Decimal:
-    return val.quantize(Decimal("0.01"), ROUND_HALF_UP)
+    return val.quantize(_Q_CENT, ROUND_HALF_UP)
+
+
+def _scaled(val: Decimal, places: int) -> Optional[int]:
+    """val * 10**places как int, если значение точно укладывается в places знаков."""
+    exponent = val.as_tuple().exponent
+    if not isinstance(exponent, int) or exponent < -places:
+        return None
+    return int(val.scaleb(places))
+
+
+def _format_cents(cents: int) -> str:
+    """Сумма в копейках → строка вида 123.45."""
+    sign = "-" if cents < 0 else ""
+    rub, kop = divmod(abs(cents), 100)
+    return f"{sign}{rub}.{kop:02d}"
+
+
+def _compute(
+    cw_new: int, cw_old: int, hw_new: int, hw_old: int, el_new: int, el_old: int,
+    cw_rate: int, hw_rate: int, wd_rate: int, el_rate: int,
+) -> tuple[int, int, int, int, int, int, int, int, int]:
+    """Расходы и суммы в копейках по целым показаниям и тарифам в копейках."""
+    cw_cons = cw_new - cw_old
+    hw_cons = hw_new - hw_old
+    wd_cons = cw_cons + hw_cons
+    el_cons = el_new - el_old
+
+    cw_amt = cw_cons * cw_rate
+    hw_amt = hw_cons * hw_rate
+    wd_amt = wd_cons * wd_rate
+    el_amt = el_cons * el_rate
+    total = cw_amt + hw_amt + wd_amt + el_amt
+
+    return cw_cons, hw_cons, wd_cons, el_cons, cw_amt, hw_amt, wd_amt, el_amt, total
 
 
 def _parse_input(text: str) -> InputData:
     """Парсит строку команды после .meter и возвращает InputData."""
 
-    payload = text.split(maxsplit=1)[1] if len(text.split(maxsplit=1)) == 2 else ""
-
-    # 1. Попробуем формат key=value (включая *_rate)
-    if "=" in payload:
-        pairs = re.findall(r"(\w+?)\s*=\s*([0-9]+(?:[.,][0-9]+)?)", payload, flags=re.I)
-        if pairs:
-            data = {
-                k.lower(): Decimal(v.replace(",", "."))
-                for k, v in pairs
-            }
-            # Проверим, есть ли хотя бы cw/hw/el
-            if {"cw", "hw", "el"}.issubset(data.keys()):
-                return InputData.model_validate(data)
+    parts = text.split(maxsplit=1)
+    payload = parts[1] if len(parts) == 2 else ""
+
+    # Один проход по payload: пары key=value в словарь (*_rate — ещё и в rates),
+    # числа без ключа в список
+    data: dict[str, Decimal] = {}
+    rates: dict[str, Decimal] = {}
+    nums: list[str] = []
+    for match in _TOKEN_RE.finditer(payload):
+        key = match.group("key")
+        if key is None:
+            nums.append(match.group("num"))
+            continue
+        key = key.lower()
+        key = _KEY_ALIASES.get(key, key)
+        value = normalize_decimal(match.group("value"))
+        data[key] = value
+        if key.endswith("_rate"):
+            rates[key] = value
+
+    # 1. Формат key=value (включая *_rate), если есть хотя бы cw/hw/el
+    if {"cw", "hw", "el"}.issubset(data.keys()):
+        return InputData.model_validate(data)
 
     # 2. Формат три числа подряд + опциональные rate после них через key=value
-    nums = re.findall(r"\d+(?:[.,]\d+)?", payload)
     if len(nums) >= 3:
-        cw, hw, el = (Decimal(n.replace(",", ".")) for n in nums[:3])
-        rest_pairs = re.findall(r"(\w+_rate)\s*=\s*([0-9]+(?:[.,][0-9]+)?)", payload, flags=re.I)
-        rates = {k.lower(): Decimal(v.replace(",", ".")) for k, v in rest_pairs}
+        cw, hw, el = (normalize_decimal(n) for n in nums[:3])
         return InputData(cw=cw, hw=hw, el=el, **rates)
 
     raise ValueError(
@@ -69,16 +129,16 @@ def _parse_input(text: str) -> InputData:
     )
 
 
-def _get_rate(override: Optional[Decimal], fallback) -> Decimal:  # noqa: ANN001
+def _get_rate(override: Optional[Decimal], fallback: Optional[UtilityReading]) -> Decimal:
     """Если пользователь дал rate — берём его, иначе старый из сообщения."""
     if override is not None:
         return override
-    if hasattr(fallback, "rate") and fallback.rate is not None:
-        return Decimal(str(fallback.rate))
+    if fallback is not None:
+        return fallback.rate
     raise AttributeError("Отсутствует тариф (rate) в старом сообщении, и он не указан в команде.")
 
 
-def _build_message(old_values, inp: InputData) -> str:  # noqa: ANN001
+def _build_message(old_values: UtilityBill, inp: InputData) -> str:
     """Собираем финальное сообщение, используя приоритет пользовательских тарифов."""
 
     # Тарифы
@@ -86,38 +146,65 @@ def _build_message(old_values, inp: InputData) -> str:  # noqa: ANN001
     hw_rate = _get_rate(inp.hw_rate, old_values.hot_water)
     el_rate = _get_rate(inp.el_rate, old_values.electricity)
 
-    wd_reading = getattr(old_values, "water_disposal", None)
-    wd_rate = _get_rate(inp.wd_rate, wd_reading) if wd_reading else (
-        inp.wd_rate if inp.wd_rate is not None else Decimal("0")
+    wd_reading = old_values.water_disposal
+    wd_rate = _get_rate(inp.wd_rate, wd_reading) if wd_reading is not None else (
+        inp.wd_rate if inp.wd_rate is not None else _D_ZERO
     )
 
-    # Расходы
-    cw_cons = inp.cw - old_values.cold_water.current
-    hw_cons = inp.hw - old_values.hot_water.current
-    wd_cons = cw_cons + hw_cons
-    el_cons = inp.el - old_values.electricity.current
-
-    cw_amt = _round(cw_cons * cw_rate)
-    hw_amt = _round(hw_cons * hw_rate)
-    wd_amt = _round(wd_cons * wd_rate)
-    el_amt = _round(el_cons * el_rate)
-    total = _round(cw_amt + hw_amt + wd_amt + el_amt)
-
-    date_str = datetime.now().strftime("%d.%m.%Y")
+    cw_old = old_values.cold_water.current
+    hw_old = old_values.hot_water.current
+    el_old = old_values.electricity.current
+
+    readings = [_scaled(v, 0) for v in (inp.cw, cw_old, inp.hw, hw_old, inp.el, el_old)]
+    rates = [_scaled(r, 2) for r in (cw_rate, hw_rate, wd_rate, el_rate)]
+
+    if None not in readings and None not in rates:
+        # Целые показания и тарифы с точностью до копейки: считаем в копейках,
+        # суммы получаются точными и округление не требуется
+        (cw_cons, hw_cons, wd_cons, el_cons,
+         cw_amt_c, hw_amt_c, wd_amt_c, el_amt_c, total_c) = _compute(*readings, *rates)
+
+        cw_amt, hw_amt, wd_amt, el_amt, total = (
+            _format_cents(c) for c in (cw_amt_c, hw_amt_c, wd_amt_c, el_amt_c, total_c)
+        )
+    else:
+        # Дробные показания или тарифы точнее копейки — считаем в Decimal
+        cw_cons = inp.cw - cw_old
+        hw_cons = inp.hw - hw_old
+        wd_cons = cw_cons + hw_cons
+        el_cons = inp.el - el_old
+
+        cw_amt = _round(cw_cons * cw_rate)
+        hw_amt = _round(hw_cons * hw_rate)
+        wd_amt = _round(wd_cons * wd_rate)
+        el_amt = _round(el_cons * el_rate)
+        total = _round(cw_amt + hw_amt + wd_amt + el_amt)
+
+    date_str = strftime("%d.%m.%Y", localtime())
 
     return (
-        f"Хол. вода:\nБыло - {old_values.cold_water.current}\nСтало - {inp.cw}\n\n"
+        f"Хол. вода:\nБыло - {cw_old}\nСтало - {inp.cw}\n\n"
         f"{cw_cons} * {cw_rate} = {cw_amt}\n\n"
-        f"Гор. вода:\nБыло - {old_values.hot_water.current}\nСтало - {inp.hw}\n\n"
+        f"Гор. вода:\nБыло - {hw_old}\nСтало - {inp.hw}\n\n"
         f"{hw_cons} * {hw_rate} = {hw_amt}\n\n"
         f"Водоотведение:\n{wd_cons} * {wd_rate} = {wd_amt}\n\n"
-        f"Электроэнергия:\nБыло - {old_values.electricity.current}\nСтало - {inp.el}\n\n"
+        f"Электроэнергия:\nБыло - {el_old}\nСтало - {inp.el}\n\n"
         f"{el_cons} * {el_rate} = {el_amt}\n\n"
         f"Итого: {total}\n\n"
         f"#счетчики {date_str}"
     )
 
 
+class _MeterFilter(filters.MessageFilter):
+    """Пропускает сообщения, начинающиеся с команды meter — без regex на каждое сообщение."""
+
+    __slots__ = ()
+
+    def filter(self, message: Message) -> bool:
+        text = message.text
+        return bool(text) and text[:6].lower().startswith(_METER_PREFIXES)
+
+
 async def calc_bill(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:  # noqa: D401
     """.meter должен быть reply к сообщению со старыми показаниями."""
     if not update.message or not update.message.reply_to_message:
@@ -134,7 +221,7 @@ async def calc_bill(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # Старые данные + тарифы
     old_text = update.message.reply_to_message.text or ""
     try:
-        old_vals = TelegramBillParser().parse_message(old_text)
+        old_vals = _PARSER.parse_message(old_text)
     except Exception as exc:  # noqa: BLE001
         await update.message.reply_text(f"Не удалось разобрать старые показания: {exc}")
         return
@@ -161,8 +248,7 @@ def main() -> None:  # noqa: D401
         .build()
     )
 
-    pattern = re.compile(r"^[/.]?meter", flags=re.I)
-    app.add_handler(MessageHandler(filters.Regex(pattern), calc_bill))
+    app.add_handler(MessageHandler(_MeterFilter(), calc_bill))
 
     app.run_polling(allowed_updates=["message"])
 